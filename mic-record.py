@@ -1,16 +1,17 @@
 import sounddevice as sd
 import numpy as np
+from scipy.signal import firwin
+import torch
+import torch.nn.functional as F
 import whisper
-import queue
 import threading
-import time
+import collections
 import signal
 import sys
 import atexit
+import os
 import pyperclip
-
-# Load the Whisper model
-model = whisper.load_model("small") # choose from small, base, medium, large-v3
+from silero_vad import load_silero_vad, get_speech_timestamps
 
 # Audio parameters
 BUFFER_SIZE = 1024
@@ -18,7 +19,79 @@ INPUT_SAMPLE_RATE = 48000    # Input sample rate from audio device
 WHISPER_SAMPLE_RATE = 16000  # Required sample rate for Whisper
 SILENCE_THRESHOLD = 0.01     # Threshold to detect more audio
 SILENCE_DURATION = 1.5      # Seconds of silence to trigger transcription
-audio_queue = queue.Queue()
+MAX_UTTERANCE_DURATION = 30  # Seconds of audio buffered before transcription is forced
+SILENCE_SAMPLES = int(SILENCE_DURATION * INPUT_SAMPLE_RATE)
+MAX_UTTERANCE_SAMPLES = MAX_UTTERANCE_DURATION * INPUT_SAMPLE_RATE
+RING_SAMPLES = 2 * MAX_UTTERANCE_SAMPLES  # Room to keep recording while one utterance is transcribed
+PCM_FULL_SCALE = 32768       # int16 samples are converted to [-1, 1) by this factor
+SILENCE_LEVEL = int(SILENCE_THRESHOLD * PCM_FULL_SCALE)
+METER_INTERVAL = 8           # Callbacks per audio level printout (~6 per second)
+BATCH_SIZE = 4               # Most queued utterances decoded in one Whisper forward pass
+# model.transcribe's defaults for discarding hallucinated or looping output
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+# Resampling is a fixed-ratio decimation: the conv1d stride is baked in at startup
+# and only every DECIMATION_FACTOR-th filter output is ever computed
+if INPUT_SAMPLE_RATE % WHISPER_SAMPLE_RATE:
+    raise ValueError(f"INPUT_SAMPLE_RATE must be a multiple of {WHISPER_SAMPLE_RATE} Hz")
+DECIMATION_FACTOR = INPUT_SAMPLE_RATE // WHISPER_SAMPLE_RATE
+# Anti-alias lowpass applied before decimating to the Whisper sample rate. The
+# cutoff sits below Whisper's 8kHz Nyquist so the whole transition band (~1.5kHz
+# at 161 taps, ~80dB stopband) ends before anything can alias into the output.
+RESAMPLE_TAPS = 161
+RESAMPLE_CUTOFF = 7250
+RESAMPLE_FILTER = firwin(
+    RESAMPLE_TAPS, RESAMPLE_CUTOFF, window=("kaiser", 8), fs=INPUT_SAMPLE_RATE
+).astype(np.float32)
+
+# Load the Whisper model
+model = whisper.load_model("small") # choose from small, base, medium, large-v3
+
+# Decode in half precision wherever the device supports it. The weights stay fp32:
+# Whisper casts them per layer and keeps its LayerNorms in fp32 on purpose.
+FP16 = model.device.type == "cuda"
+# Only the text is used, so skip timestamp tokens
+DECODING_OPTIONS = whisper.DecodingOptions(language="en", fp16=FP16, without_timestamps=True)
+
+# Silero VAD screens each utterance so Whisper only runs on actual speech
+vad_model = load_silero_vad()
+
+# torch releases the GIL inside its kernels, but on CPU its thread pool would
+# otherwise occupy every core; leave one free so the audio callback keeps up.
+if model.device.type == "cpu":
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) - 1))
+
+# The int16 -> float conversion is folded into the taps, so it costs no extra pass
+RESAMPLE_KERNEL = torch.from_numpy(RESAMPLE_FILTER / PCM_FULL_SCALE).to(model.device).view(1, 1, -1)
+# Whisper works on fixed 30s windows; resampled audio is written into these zeroed
+# rows so mel spectrograms are computed straight from them without re-padding
+whisper_pad = torch.zeros(BATCH_SIZE, whisper.audio.N_SAMPLES, device=model.device)
+# Device-side staging for one utterance's raw samples: copied over as int16, then
+# converted in place, so resampling allocates no per-utterance input buffers
+staging_pcm = torch.zeros(MAX_UTTERANCE_SAMPLES, dtype=torch.int16, device=model.device)
+staging_audio = torch.zeros(MAX_UTTERANCE_SAMPLES, device=model.device)
+# STFT window and mel filterbank, kept on the model's device so computing
+# spectrograms needs no per-call setup or host-to-device transfer
+STFT_WINDOW = torch.hann_window(whisper.audio.N_FFT, device=model.device)
+MEL_FILTERS = whisper.audio.mel_filters(model.device, model.dims.n_mels)
+# Silero runs on the CPU; on CUDA resampled windows are copied into this pinned
+# buffer, while on CPU they are already usable as they are
+vad_input = (torch.zeros(MAX_UTTERANCE_SAMPLES // DECIMATION_FACTOR, pin_memory=True)
+             if model.device.type == "cuda" else None)
+# Single-producer/single-consumer ring: the callback only advances write_idx and the
+# transcription thread only advances read_idx, so neither side takes a lock per block.
+# All indices count samples since startup; positions in the ring are taken modulo its size.
+audio_ring = np.empty(RING_SAMPLES, dtype=np.int16)
+write_idx = 0        # Samples written by the callback
+read_idx = 0         # Samples the transcription thread is done with
+last_speech_idx = 0  # Value of write_idx after the last block above SILENCE_LEVEL
+utterance_start = 0  # Where the utterance currently being recorded begins
+utterances = collections.deque()  # (start, end) of utterances awaiting transcription
+utterance_ready = threading.Event()
+meter_blocks = 0  # Callbacks since the audio level was last printed
+meter_peak = 0    # Loudest block level over those callbacks
+overflowing = False  # Whether the callback is currently dropping input for lack of space
 stop_flag = threading.Event()
 recording_flag = threading.Event()
 stream = None
@@ -34,13 +107,57 @@ atexit.register(cleanup)
 
 def audio_callback(indata, frames, time, status):
     """Callback function to capture audio data."""
+    global write_idx, last_speech_idx, meter_blocks, meter_peak, overflowing
     if status:
         print(status)
     if recording_flag.is_set():
-        max_val = np.max(np.abs(indata))
-        if max_val > SILENCE_THRESHOLD:
-            print(f"Audio level: {max_val:.3f}", end="\r")
-        audio_queue.put(indata.copy())
+        block = indata[:, 0]
+        # max/min rather than np.abs: no temporary, and no overflow on -32768
+        max_val = max(int(block.max()), -int(block.min()))
+        # Terminal output is slow, so only report the peak every METER_INTERVAL blocks
+        meter_peak = max(meter_peak, max_val)
+        meter_blocks += 1
+        if meter_blocks == METER_INTERVAL:
+            if meter_peak > SILENCE_LEVEL:
+                print(f"Audio level: {meter_peak / PCM_FULL_SCALE:.3f}", end="\r")
+            meter_blocks = 0
+            meter_peak = 0
+        if write_idx + frames - read_idx > RING_SAMPLES:
+            # Report once per overflow rather than from every dropped block
+            if not overflowing:
+                print("Audio buffer full, dropping input")
+                overflowing = True
+            return
+        overflowing = False
+        if write_idx + frames - utterance_start > MAX_UTTERANCE_SAMPLES:
+            end_utterance()
+
+        pos = write_idx % RING_SAMPLES
+        first = min(frames, RING_SAMPLES - pos)
+        audio_ring[pos:pos + first] = block[:first]
+        audio_ring[:frames - first] = block[first:]
+        write_idx += frames
+        if max_val > SILENCE_LEVEL:
+            last_speech_idx = write_idx
+        if write_idx - max(last_speech_idx, utterance_start) >= SILENCE_SAMPLES:
+            end_utterance()
+
+def end_utterance():
+    """Hands the audio recorded since utterance_start to the transcription thread."""
+    global utterance_start
+    utterances.append((utterance_start, write_idx))
+    utterance_start = write_idx
+    utterance_ready.set()
+
+def ring_views(start, end):
+    """Returns the ring samples in [start, end) as one view, or two if they wrap around."""
+    length = end - start
+    pos = start % RING_SAMPLES
+    first = min(length, RING_SAMPLES - pos)
+    views = [audio_ring[pos:pos + first]]
+    if first < length:
+        views.append(audio_ring[:length - first])
+    return views
 
 def copy_to_clipboard(text):
     """Copies the given text to the clipboard."""
@@ -50,60 +167,113 @@ def copy_to_clipboard(text):
     except pyperclip.PyperclipException as e:
         print(f"Error copying to clipboard: {e}. Ensure you have xclip or xsel installed.")
 
+def resample_utterance(views, out):
+    """Resamples 48kHz int16 ring views into `out`, a zero-padded Whisper window on the model's device."""
+    length = 0
+    for view in views:
+        staging_pcm[length:length + len(view)].copy_(torch.from_numpy(view))
+        length += len(view)
+    audio_tensor = staging_audio[:length]
+    audio_tensor.copy_(staging_pcm[:length])
+
+    # Lowpass and keep every third sample in one strided conv1d. Samples cross to the
+    # device as int16 and are scaled by the taps; int16 input is already within
+    # [-1, 1) so no further normalization is needed. Direct convolution stays cheaper
+    # than FFT convolution here: the stride means only RESAMPLE_TAPS / 3 multiply-adds
+    # per input sample, while an FFT would compute every output just to discard 2 in 3.
+    resampled_audio = F.conv1d(
+        audio_tensor.view(1, 1, -1),
+        RESAMPLE_KERNEL,
+        stride=DECIMATION_FACTOR,
+        padding=RESAMPLE_KERNEL.shape[-1] // 2
+    ).view(-1)
+
+    # MAX_UTTERANCE_DURATION keeps the resampled audio within one Whisper window
+    resampled_length = min(len(resampled_audio), whisper.audio.N_SAMPLES)
+    out[:resampled_length] = resampled_audio[:resampled_length]
+    out[resampled_length:] = 0.0
+    return resampled_length
+
+def log_mel_spectrogram(windows):
+    """Batched whisper.log_mel_spectrogram for rows of whisper_pad, using the cached window and filterbank."""
+    stft = torch.stft(windows, whisper.audio.N_FFT, whisper.audio.HOP_LENGTH,
+                      window=STFT_WINDOW, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+    log_spec = torch.clamp(MEL_FILTERS @ magnitudes, min=1e-10).log10()
+    # Clamp against each window's own maximum, as whisper does for a single input
+    log_spec = torch.maximum(log_spec, log_spec.amax(dim=(-2, -1), keepdim=True) - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+def keep_result(result):
+    """Applies model.transcribe's checks for silence mistaken as speech and repetition loops."""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+        return False
+    if result.compression_ratio > COMPRESSION_RATIO_THRESHOLD:
+        return False
+    return bool(result.text.strip())
+
+def contains_speech(audio):
+    """Returns True if Silero VAD finds speech in the given 16kHz audio."""
+    if vad_input is not None:
+        audio = vad_input[:len(audio)].copy_(audio)
+    return len(get_speech_timestamps(audio, vad_model, sampling_rate=WHISPER_SAMPLE_RATE)) > 0
+
 def transcribe_audio():
     """Thread to transcribe audio in real time."""
-    audio_buffer = []
-    last_speech_time = time.time()
+    global read_idx
     transcribing = False
 
     while not stop_flag.is_set():
         try:
-            audio_data = audio_queue.get(timeout=0.1)
-            audio_buffer.append(audio_data)
-            max_val = np.max(np.abs(audio_data))
-            if max_val > SILENCE_THRESHOLD:
-                last_speech_time = time.time()
-
-            if time.time() - last_speech_time >= SILENCE_DURATION and len(audio_buffer) > 0:
-                # Silence detected, process the audio
-                transcribing = True
-                concatenated_audio = np.concatenate(audio_buffer, axis=0)
-                audio_data = concatenated_audio.flatten()
-                max_volume = max(abs(audio_data.max()), abs(audio_data.min()))
-                print(f"\nProcessing audio... (max volume: {max_volume:.3f})")
-
-                try:
-                    # Resample from 48kHz to 16kHz
-                    audio_length = len(audio_data)
-                    resampled_length = int(audio_length * WHISPER_SAMPLE_RATE / INPUT_SAMPLE_RATE)
-                    resampled_audio = np.interp(
-                        np.linspace(0, audio_length, resampled_length),
-                        np.linspace(0, audio_length, audio_length),
-                        audio_data
-                    )
-
-                    # Normalize audio
-                    resampled_audio = resampled_audio.astype(np.float32)
-                    if resampled_audio.max() > 1.0 or resampled_audio.min() < -1.0:
-                        resampled_audio = resampled_audio / max(abs(resampled_audio.max()), abs(resampled_audio.min()))
-
-                    result = model.transcribe(resampled_audio, language="en")
-                    text = result['text'].strip()
-                    if text:
-                        print(f"\nTranscription: {text}")
-                        copy_to_clipboard(text)
-                    else:
-                        print("\nNo speech detected in audio")
-                except Exception as e:
-                    print(f"\nTranscription error: {e}")
-
-                # Clear the buffer
-                audio_buffer = []
-                last_speech_time = time.time()
-                transcribing = False
-
-        except queue.Empty:
-            continue
+            if not utterance_ready.wait(timeout=0.1):
+                continue
+            # Clear before draining so an utterance queued meanwhile sets it again
+            utterance_ready.clear()
+            # Utterances that piled up while Whisper was busy are decoded together in
+            # one batched forward pass
+            batch = []
+            while utterances and len(batch) < BATCH_SIZE:
+                batch.append(utterances.popleft())
+            if not batch:
+                continue
+            if utterances:
+                utterance_ready.set()
+
+            # Silence detected, process the audio. The callback never writes past
+            # read_idx, so the views stay valid until read_idx is advanced below.
+            transcribing = True
+            batch_audio = [ring_views(start, end) for start, end in batch]
+            max_volume = max(
+                max(int(view.max()), -int(view.min())) for views in batch_audio for view in views
+            ) / PCM_FULL_SCALE
+            print(f"\nProcessing {len(batch)} utterance(s)... (max volume: {max_volume:.3f})")
+
+            try:
+                # Utterances without speech give up their window to the next one
+                speech_windows = 0
+                for views in batch_audio:
+                    out = whisper_pad[speech_windows]
+                    resampled_length = resample_utterance(views, out)
+                    if contains_speech(out[:resampled_length]):
+                        speech_windows += 1
+
+                text = ""
+                if speech_windows:
+                    mel = log_mel_spectrogram(whisper_pad[:speech_windows])
+                    results = whisper.decode(model, mel, DECODING_OPTIONS)
+                    text = " ".join(r.text.strip() for r in results if keep_result(r))
+                if text:
+                    print(f"\nTranscription: {text}")
+                    copy_to_clipboard(text)
+                else:
+                    print("\nNo speech detected in audio")
+            except Exception as e:
+                print(f"\nTranscription error: {e}")
+
+            # Release the processed samples back to the callback
+            read_idx = batch[-1][1]
+            transcribing = False
+
         except Exception as e:
             print(f"Error in transcription thread: {e}")
             break
@@ -118,12 +288,11 @@ def audio_input_thread(device_idx, sample_rate):
             samplerate=INPUT_SAMPLE_RATE,
             blocksize=BUFFER_SIZE,
             device=device_idx,
-            dtype=np.float32
+            dtype=np.int16
         )
         with stream:
             print(f"Listening on device {device_idx} at {INPUT_SAMPLE_RATE} Hz... Press Ctrl+C to stop.")
-            while not stop_flag.is_set():
-                time.sleep(0.1)
+            stop_flag.wait()
     except Exception as e:
         print(f"Error in audio input thread: {e}")
         stop_flag.set()